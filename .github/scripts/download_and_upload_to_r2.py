@@ -5,13 +5,15 @@ This is the first step in the workflow
 
 import os
 import sys
-import json
+import shutil
 import subprocess
-import zipfile
-import boto3
+from bisect import bisect_left
+import orjson
+from boto3.s3.transfer import TransferConfig, create_transfer_manager
 from botocore.exceptions import ClientError
+from r2_common import get_s3_client, run_streaming, get_work_dir
 
-def download_youtube_video(video_id, output_dir, cookies_file=None):
+def download_youtube_video(video_id, output_dir, cookies_file=None, concurrency=8):
     """Download video from YouTube using yt-dlp"""
     print(f"📥 Downloading video from YouTube: {video_id}")
     
@@ -29,8 +31,18 @@ def download_youtube_video(video_id, output_dir, cookies_file=None):
         '--write-info-json',
         '--write-description',
         '--write-thumbnail',
+        '--concurrent-fragments', str(concurrency),
+        '--http-chunk-size', '10M',
     ]
     
+    # Hand downloads to aria2c (multi-connection, native code) when installed;
+    # otherwise the native downloader above fetches fragments concurrently
+    if shutil.which('aria2c'):
+        cmd.extend([
+            '--downloader', 'aria2c',
+            '--downloader-args', 'aria2c:-x 16 -s 16 -k 1M',
+        ])
+    
     # Add cookies if available
     if cookies_file and os.path.exists(cookies_file):
         print(f"  Using cookies file: {cookies_file}")
@@ -43,9 +55,9 @@ def download_youtube_video(video_id, output_dir, cookies_file=None):
     print(f"  Executing: {' '.join(cmd)}")
     
     try:
-        result = subprocess.run(cmd, capture_output=True, text=True, timeout=600)
+        returncode, stderr_tail = run_streaming(cmd, timeout=600, echo=True)
         
-        if result.returncode == 0:
+        if returncode == 0:
             # Find the downloaded video file
             video_file = os.path.join(output_dir, f"{video_id}.mp4")
             if os.path.exists(video_file):
@@ -56,7 +68,7 @@ def download_youtube_video(video_id, output_dir, cookies_file=None):
                 print(f"❌ Video file not found: {video_file}")
                 return None
         else:
-            print(f"❌ yt-dlp failed: {result.stderr}")
+            print(f"❌ yt-dlp failed: {stderr_tail}")
             return None
             
     except subprocess.TimeoutExpired:
@@ -66,15 +78,23 @@ def download_youtube_video(video_id, output_dir, cookies_file=None):
         print(f"❌ Error: {e}")
         return None
 
-def get_video_transcript(video_id):
+def get_video_transcript(video_id, cookies_file=None):
     """Get video transcript using youtube-transcript-api"""
     print(f"📝 Fetching transcript for: {video_id}")
     
     try:
-        from youtube_transcript_api import YouTubeTranscriptApi
+        from youtube_transcript_api import YouTubeTranscriptApi, CookiePathInvalid, CookiesInvalid
         
-        # Try to get transcript
-        transcript_list = YouTubeTranscriptApi.list_transcripts(video_id)
+        # Cookies help against bot detection, but a stale or malformed file
+        # must not cost us the transcript
+        transcript_list = None
+        if cookies_file:
+            try:
+                transcript_list = YouTubeTranscriptApi.list_transcripts(video_id, cookies=cookies_file)
+            except (CookiePathInvalid, CookiesInvalid) as e:
+                print(f"⚠️  Cookies rejected ({type(e).__name__}), retrying without them")
+        if transcript_list is None:
+            transcript_list = YouTubeTranscriptApi.list_transcripts(video_id)
         
         # Try manual first, then auto-generated
         try:
@@ -95,30 +115,33 @@ def create_analysis_json(video_id, video_file, transcript, output_dir):
     """Create analysis JSON file"""
     print(f"📊 Creating analysis file...")
     
-    # Get video duration using ffprobe
-    try:
-        cmd = [
-            'ffprobe',
-            '-v', 'error',
-            '-show_entries', 'format=duration',
-            '-of', 'default=noprint_wrappers=1:nokey=1',
-            video_file
-        ]
-        result = subprocess.run(cmd, capture_output=True, text=True)
-        duration = float(result.stdout.strip())
-    except:
-        duration = 0
-    
     # Read video info if available
     info_file = os.path.join(output_dir, f"{video_id}.info.json")
     title = video_id
     description = ""
+    duration = 0
     
     if os.path.exists(info_file):
-        with open(info_file, 'r', encoding='utf-8') as f:
-            info = json.load(f)
+        with open(info_file, 'rb') as f:
+            info = orjson.loads(f.read())
             title = info.get('title', video_id)
             description = info.get('description', '')
+            duration = info.get('duration') or 0
+    
+    # Fall back to ffprobe only when yt-dlp did not report a duration
+    if not duration:
+        try:
+            cmd = [
+                'ffprobe',
+                '-v', 'error',
+                '-show_entries', 'format=duration',
+                '-of', 'default=noprint_wrappers=1:nokey=1',
+                video_file
+            ]
+            result = subprocess.run(cmd, capture_output=True, text=True)
+            duration = float(result.stdout.strip())
+        except:
+            duration = 0
     
     # Create basic analysis structure
     analysis = {
@@ -135,15 +158,18 @@ def create_analysis_json(video_id, video_file, transcript, output_dir):
         segment_duration = 60  # 60 second segments
         num_segments = int(duration // segment_duration)
         
+        # Sort once so each segment's entries can be sliced by binary search
+        entries = sorted(transcript, key=lambda entry: entry['start'])
+        starts = [entry['start'] for entry in entries]
+        
         for i in range(min(num_segments, 10)):  # Max 10 segments
             start = i * segment_duration
             end = min(start + segment_duration, duration)
             
             # Get transcript text for this segment
-            segment_text = ""
-            for entry in transcript:
-                if start <= entry['start'] < end:
-                    segment_text += entry['text'] + " "
+            lo = bisect_left(starts, start)
+            hi = bisect_left(starts, end)
+            segment_text = " ".join(entry['text'] for entry in entries[lo:hi])
             
             segment = {
                 "start": start,
@@ -157,69 +183,53 @@ def create_analysis_json(video_id, video_file, transcript, output_dir):
     
     # Save analysis file
     analysis_file = os.path.join(output_dir, f"{video_id}_analysis.json")
-    with open(analysis_file, 'w', encoding='utf-8') as f:
-        json.dump(analysis, f, indent=2, ensure_ascii=False)
+    with open(analysis_file, 'wb') as f:
+        f.write(orjson.dumps(analysis, option=orjson.OPT_INDENT_2))
     
     print(f"✅ Created analysis with {len(analysis['segments'])} segments")
     return analysis_file
 
-def create_zip_archive(video_id, video_file, output_dir):
-    """Create ZIP archive of the video"""
-    print(f"📦 Creating ZIP archive...")
-    
-    zip_path = os.path.join(output_dir, f"{video_id}.zip")
-    
-    with zipfile.ZipFile(zip_path, 'w', zipfile.ZIP_DEFLATED) as zipf:
-        # Add video file
-        zipf.write(video_file, os.path.basename(video_file))
-        
-        # Add info files if they exist
-        for ext in ['.info.json', '.description', '.jpg', '.webp']:
-            info_file = os.path.join(output_dir, f"{video_id}{ext}")
-            if os.path.exists(info_file):
-                zipf.write(info_file, os.path.basename(info_file))
-    
-    size_mb = os.path.getsize(zip_path) / (1024 * 1024)
-    print(f"✅ Created archive: {size_mb:.2f} MB")
-    return zip_path
-
-def upload_to_r2(video_id, zip_path, analysis_path, r2_config):
-    """Upload files to R2"""
+def upload_to_r2(files, r2_config):
+    """Upload files to R2 in parallel, given (local_path, key) pairs"""
     print(f"☁️  Uploading to R2...")
     
-    # Initialize S3 client
-    s3 = boto3.client(
-        's3',
-        endpoint_url=r2_config['endpoint'],
-        aws_access_key_id=r2_config['access_key'],
-        aws_secret_access_key=r2_config['secret_key'],
-        region_name='auto'
+    # Multipart upload with 64 MB parts sent in parallel; anything smaller
+    # than one part is a single PUT rather than a one-part multipart upload
+    transfer_config = TransferConfig(
+        multipart_threshold=64 * 1024 * 1024,
+        multipart_chunksize=64 * 1024 * 1024,
+        max_concurrency=16,
+        use_threads=True
     )
     
+    s3 = get_s3_client(r2_config['endpoint'], r2_config['access_key'], r2_config['secret_key'])
+    
     bucket = r2_config['bucket']
     
-    try:
-        # Upload ZIP file
-        zip_key = f"{video_id}/{video_id}.zip"
-        print(f"  Uploading: {zip_key}")
-        s3.upload_file(zip_path, bucket, zip_key)
-        print(f"  ✅ Uploaded ZIP")
-        
-        # Upload analysis JSON
-        json_key = f"{video_id}/{video_id}_analysis.json"
-        print(f"  Uploading: {json_key}")
-        s3.upload_file(analysis_path, bucket, json_key)
-        print(f"  ✅ Uploaded analysis")
-        
-        print(f"✅ All files uploaded to R2")
-        return True
+    failed = 0
+    with create_transfer_manager(s3, transfer_config) as transfer_manager:
+        futures = [
+            (key, transfer_manager.upload(local_path, bucket, key))
+            for local_path, key in files
+        ]
         
-    except ClientError as e:
-        print(f"❌ R2 upload failed: {e}")
-        return False
-    except Exception as e:
-        print(f"❌ Error: {e}")
+        for key, future in futures:
+            try:
+                future.result()
+                print(f"  ✅ Uploaded: {key}")
+            except ClientError as e:
+                print(f"  ❌ R2 upload failed for {key}: {e}")
+                failed += 1
+            except Exception as e:
+                print(f"  ❌ Error uploading {key}: {e}")
+                failed += 1
+    
+    if failed:
+        print(f"❌ {failed}/{len(files)} file(s) failed to upload")
         return False
+    
+    print(f"✅ All files uploaded to R2")
+    return True
 
 def main():
     """Main workflow"""
@@ -234,6 +244,7 @@ def main():
     r2_secret_key = os.environ.get('R2_PROCESSING_SECRET_KEY')
     r2_endpoint = os.environ.get('R2_PROCESSING_ENDPOINT')
     r2_bucket = os.environ.get('R2_PROCESSING_BUCKET')
+    ytdlp_concurrency = int(os.environ.get('YTDLP_CONCURRENCY', '8'))
     
     # Validate
     if not all([video_id, r2_access_key, r2_secret_key, r2_endpoint, r2_bucket]):
@@ -249,9 +260,10 @@ def main():
     print(f"📦 R2 Bucket: {r2_bucket}")
     print()
     
-    # Create temp directory
-    temp_dir = f"temp/{video_id}"
+    # Create temp directory (on tmpfs when available, so I/O stays in RAM)
+    temp_dir = os.path.join(get_work_dir(), "temp", video_id)
     os.makedirs(temp_dir, exist_ok=True)
+    print(f"📁 Working directory: {temp_dir}")
     
     # Check for cookies file (in repository root or current directory)
     cookies_file = None
@@ -269,23 +281,32 @@ def main():
     print()
     
     # Step 1: Download from YouTube
-    video_file = download_youtube_video(video_id, temp_dir, cookies_file)
+    video_file = download_youtube_video(video_id, temp_dir, cookies_file, ytdlp_concurrency)
     if not video_file:
         print("❌ Failed to download video")
         sys.exit(1)
     print()
     
     # Step 2: Get transcript
-    transcript = get_video_transcript(video_id)
+    transcript = get_video_transcript(video_id, cookies_file)
     print()
     
     # Step 3: Create analysis
     analysis_file = create_analysis_json(video_id, video_file, transcript, temp_dir)
     print()
     
-    # Step 4: Create ZIP archive
-    zip_file = create_zip_archive(video_id, video_file, temp_dir)
-    print()
+    # Step 4: Collect files to upload (each one is stored as its own object)
+    files = [
+        (video_file, f"{video_id}/{os.path.basename(video_file)}"),
+        (analysis_file, f"{video_id}/{os.path.basename(analysis_file)}"),
+    ]
+    # One directory read instead of a stat() per candidate sidecar
+    prefix = f"{video_id}."
+    sidecars = {'info.json', 'description', 'jpg', 'webp'}
+    with os.scandir(temp_dir) as entries:
+        for entry in entries:
+            if entry.name.startswith(prefix) and entry.name[len(prefix):] in sidecars:
+                files.append((entry.path, f"{video_id}/{entry.name}"))
     
     # Step 5: Upload to R2
     r2_config = {
@@ -295,7 +316,7 @@ def main():
         'bucket': r2_bucket
     }
     
-    success = upload_to_r2(video_id, zip_file, analysis_file, r2_config)
+    success = upload_to_r2(files, r2_config)
     
     if success:
         print()
@@ -2,11 +2,23 @@
 
 import os
 import sys
-import boto3
+import zipfile
+from boto3.s3.transfer import TransferConfig
 from botocore.exceptions import ClientError
+from r2_common import get_s3_client
+
+def object_exists(s3_client, bucket, key):
+    """HEAD one key: True if present, False on 404; other errors propagate"""
+    try:
+        s3_client.head_object(Bucket=bucket, Key=key)
+        return True
+    except ClientError as e:
+        if e.response['Error']['Code'] == '404':
+            return False
+        raise
 
 def download_from_r2():
-    """Download video archive and analysis JSON from R2"""
+    """Download video and analysis JSON from R2"""
     
     # Get environment variables
     video_id = os.environ.get('VIDEO_ID')
@@ -30,39 +42,45 @@ def download_from_r2():
     print(f"🌐 Endpoint: {r2_endpoint}")
     print()
     
-    # Initialize S3 client
-    s3_client = boto3.client(
-        's3',
-        endpoint_url=r2_endpoint,
-        aws_access_key_id=r2_access_key,
-        aws_secret_access_key=r2_secret_key,
-        region_name='auto'
+    # Ranged GETs of 32 MB fetched in parallel
+    transfer_config = TransferConfig(
+        multipart_chunksize=32 * 1024 * 1024,
+        max_concurrency=16,
+        use_threads=True
     )
     
+    s3_client = get_s3_client(r2_endpoint, r2_access_key, r2_secret_key)
+    
     # Create temp directory
     temp_dir = f"temp/{video_id}"
     os.makedirs(temp_dir, exist_ok=True)
     
     try:
-        # Download video archive
+        # Download video
+        video_key = f"{video_id}/{video_id}.mp4"
+        video_path = os.path.join(temp_dir, f"{video_id}.mp4")
+        # Videos uploaded before the ZIP step was dropped only exist as an archive
         zip_key = f"{video_id}/{video_id}.zip"
-        zip_path = os.path.join(temp_dir, f"{video_id}.zip")
         
-        print(f"📦 Checking if file exists: {zip_key}")
+        print(f"📦 Checking if file exists: {video_key}")
         
         # Check if file exists first
         try:
-            s3_client.head_object(Bucket=r2_bucket, Key=zip_key)
-            print(f"✓ File exists in R2")
-        except ClientError as e:
-            if e.response['Error']['Code'] == '404':
-                print(f"❌ File not found in R2: {zip_key}")
+            if object_exists(s3_client, r2_bucket, video_key):
+                archived = False
+            elif object_exists(s3_client, r2_bucket, zip_key):
+                print(f"   Not found, using legacy archive: {zip_key}")
+                archived = True
+            else:
+                print(f"❌ File not found in R2: {video_key} (or {zip_key})")
                 print(f"   Bucket: {r2_bucket}")
                 print(f"   Please ensure the video has been uploaded to R2 first")
                 return False
-            elif e.response['Error']['Code'] == '403':
+            print(f"✓ File exists in R2")
+        except ClientError as e:
+            if e.response['Error']['Code'] == '403':
                 print(f"❌ Access denied (403 Forbidden)")
-                print(f"   Key: {zip_key}")
+                print(f"   Key: {video_key}")
                 print(f"   Bucket: {r2_bucket}")
                 print(f"   This usually means:")
                 print(f"   1. R2 credentials don't have read permission")
@@ -73,18 +91,27 @@ def download_from_r2():
             else:
                 raise
         
-        print(f"⬇️  Downloading {zip_key}...")
-        s3_client.download_file(r2_bucket, zip_key, zip_path)
+        if archived:
+            # The archive holds the mp4 and its sidecars; unpack next to the analysis
+            zip_path = os.path.join(temp_dir, f"{video_id}.zip")
+            print(f"⬇️  Downloading {zip_key}...")
+            s3_client.download_file(r2_bucket, zip_key, zip_path, Config=transfer_config)
+            with zipfile.ZipFile(zip_path) as zipf:
+                zipf.extractall(temp_dir)
+            os.remove(zip_path)
+        else:
+            print(f"⬇️  Downloading {video_key}...")
+            s3_client.download_file(r2_bucket, video_key, video_path, Config=transfer_config)
         
-        file_size = os.path.getsize(zip_path) / (1024 * 1024)
-        print(f"✅ Downloaded video archive: {file_size:.2f} MB")
+        file_size = os.path.getsize(video_path) / (1024 * 1024)
+        print(f"✅ Downloaded video: {file_size:.2f} MB")
         
         # Download analysis JSON
         json_key = f"{video_id}/{video_id}_analysis.json"
         json_path = os.path.join(temp_dir, f"{video_id}_analysis.json")
         
         print(f"⬇️  Downloading {json_key}...")
-        s3_client.download_file(r2_bucket, json_key, json_path)
+        s3_client.download_file(r2_bucket, json_key, json_path, Config=transfer_config)
         print(f"✅ Downloaded analysis JSON")
         
         print(f"\n✅ All files downloaded successfully to: {temp_dir}")
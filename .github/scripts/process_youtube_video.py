@@ -4,15 +4,35 @@ No intermediate R2 storage needed
 """
 
 import os
+import re
 import sys
-import json
+import shutil
 import subprocess
-import boto3
-from botocore.exceptions import ClientError
+from itertools import chain
+from http.client import HTTPConnection
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import orjson
+from boto3.s3.transfer import TransferConfig, create_transfer_manager
+from botocore.exceptions import BotoCoreError, ClientError
+from urllib3 import connection as urllib3_connection
 from sqlalchemy import create_engine, Column, Integer, String, Text, DateTime, Float
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 from datetime import datetime
+from r2_common import get_s3_client, run_streaming, get_work_dir
+
+# Anything that is not a (Unicode) letter, digit, '_' or '-'
+_UNSAFE_FILENAME_CHARS = re.compile(r'[^\w-]+')
+
+# Widen the socket write block size (8-16 KiB by default) so request bodies
+# are sent to R2 in 1 MiB writes instead of many small ones
+HTTP_BLOCKSIZE = 1024 * 1024
+HTTPConnection.__init__.__defaults__ = tuple(
+    HTTP_BLOCKSIZE if x == 8192 else x for x in HTTPConnection.__init__.__defaults__
+)
+for _conn_cls in (urllib3_connection.HTTPConnection, urllib3_connection.HTTPSConnection):
+    if 'blocksize' in (_conn_cls.__init__.__kwdefaults__ or {}):
+        _conn_cls.__init__.__kwdefaults__['blocksize'] = HTTP_BLOCKSIZE
 
 Base = declarative_base()
 
@@ -32,7 +52,7 @@ class Video(Base):
     created_at = Column(DateTime, default=datetime.utcnow)
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
-def download_youtube_video(video_id, output_dir, cookies_file=None):
+def download_youtube_video(video_id, output_dir, cookies_file=None, concurrency=8):
     """Download video from YouTube using yt-dlp"""
     print(f"📥 Downloading video from YouTube: {video_id}")
     
@@ -45,8 +65,18 @@ def download_youtube_video(video_id, output_dir, cookies_file=None):
         '--merge-output-format', 'mp4',
         '-o', output_template,
         '--write-info-json',
+        '--concurrent-fragments', str(concurrency),
+        '--http-chunk-size', '10M',
     ]
     
+    # Hand downloads to aria2c (multi-connection, native code) when installed;
+    # otherwise the native downloader above fetches fragments concurrently
+    if shutil.which('aria2c'):
+        cmd.extend([
+            '--downloader', 'aria2c',
+            '--downloader-args', 'aria2c:-x 16 -s 16 -k 1M',
+        ])
+    
     if cookies_file and os.path.exists(cookies_file):
         print(f"  🍪 Using cookies: {cookies_file}")
         cmd.extend(['--cookies', cookies_file])
@@ -54,16 +84,16 @@ def download_youtube_video(video_id, output_dir, cookies_file=None):
     cmd.append(f'https://www.youtube.com/watch?v={video_id}')
     
     try:
-        result = subprocess.run(cmd, capture_output=True, text=True, timeout=600)
+        returncode, stderr_tail = run_streaming(cmd, timeout=600, echo=True)
         
-        if result.returncode == 0:
+        if returncode == 0:
             video_file = os.path.join(output_dir, f"{video_id}.mp4")
             if os.path.exists(video_file):
                 size_mb = os.path.getsize(video_file) / (1024 * 1024)
                 print(f"  ✅ Downloaded: {size_mb:.2f} MB")
                 return video_file
         
-        print(f"  ❌ yt-dlp failed: {result.stderr}")
+        print(f"  ❌ yt-dlp failed: {stderr_tail}")
         return None
         
     except subprocess.TimeoutExpired:
@@ -78,12 +108,12 @@ def get_video_info(video_id, downloads_dir):
     info_file = os.path.join(downloads_dir, f"{video_id}.info.json")
     
     if os.path.exists(info_file):
-        with open(info_file, 'r', encoding='utf-8') as f:
-            info = json.load(f)
+        with open(info_file, 'rb') as f:
+            info = orjson.loads(f.read())
             return {
                 'title': info.get('title', video_id),
                 'description': info.get('description', ''),
-                'duration': info.get('duration', 0)
+                'duration': info.get('duration') or 0
             }
     
     return {'title': video_id, 'description': '', 'duration': 0}
@@ -105,10 +135,9 @@ def create_segments(video_id, video_file, video_info):
     """Create segments for processing"""
     print(f"📊 Creating segments...")
     
-    duration = video_info.get('duration', 0)
-    
-    # Get actual duration using ffprobe if not available
-    if duration == 0:
+    # Trust the yt-dlp info.json duration; only ffprobe when it is missing
+    duration = video_info.get('duration') or 0
+    if not duration:
         try:
             cmd = [
                 'ffprobe', '-v', 'error',
@@ -145,12 +174,7 @@ def create_segments(video_id, video_file, video_info):
 
 def sanitize_filename(title, max_length=50):
     """Sanitize filename"""
-    invalid_chars = '<>:"/\\|?*'
-    for char in invalid_chars:
-        title = title.replace(char, '')
-    title = title.replace(' ', '_')
-    title = ''.join(c for c in title if c.isalnum() or c in ['_', '-'])
-    return title[:max_length].strip('_')
+    return _UNSAFE_FILENAME_CHARS.sub('', title.replace(' ', '_'))[:max_length].strip('_')
 
 def format_timestamp(seconds):
     """Convert seconds to HH:MM:SS format"""
@@ -160,47 +184,110 @@ def format_timestamp(seconds):
     ms = int((seconds % 1) * 1000)
     return f"{hours:02d}:{minutes:02d}:{secs:02d}.{ms:03d}"
 
-def cut_video_segment(input_file, output_file, start_time, end_time):
-    """Cut video segment using FFmpeg"""
+def cut_video_segment(input_file, output_file, start_time, end_time, threads=0):
+    """Cut video segment using FFmpeg (stream copy, re-encode as fallback)
+    
+    `threads` caps the encoder threads for the fallback (0 = all cores).
+    """
     try:
         duration = end_time - start_time
         
+        # Stream copy: remux existing packets without decoding
         cmd = [
             'ffmpeg', '-ss', format_timestamp(start_time),
             '-i', input_file,
             '-t', format_timestamp(duration),
-            '-c:v', 'libx264', '-c:a', 'aac',
-            '-preset', 'fast', '-crf', '23',
+            '-c', 'copy',
+            '-avoid_negative_ts', 'make_zero',
             '-y', output_file
         ]
         
-        result = subprocess.run(cmd, capture_output=True, text=True, timeout=300)
+        returncode, stderr_tail = run_streaming(cmd, timeout=300)
+        
+        if returncode != 0 or not os.path.exists(output_file) or os.path.getsize(output_file) == 0:
+            print(f"    ⚠️  Stream copy failed, re-encoding: {os.path.basename(output_file)}")
+            cmd = [
+                'ffmpeg', '-ss', format_timestamp(start_time),
+                '-i', input_file,
+                '-t', format_timestamp(duration),
+                '-c:v', 'libx264', '-c:a', 'aac',
+                '-preset', 'ultrafast', '-tune', 'fastdecode', '-crf', '23',
+                '-threads', str(threads),
+                '-y', output_file
+            ]
+            returncode, stderr_tail = run_streaming(cmd, timeout=300)
         
-        if result.returncode == 0 and os.path.exists(output_file):
+        if returncode == 0 and os.path.exists(output_file):
             size_mb = os.path.getsize(output_file) / (1024 * 1024)
-            print(f"    ✅ Created: {size_mb:.2f} MB")
+            print(f"    ✅ Created {os.path.basename(output_file)}: {size_mb:.2f} MB")
             return True
         else:
-            print(f"    ❌ FFmpeg error")
+            print(f"    ❌ FFmpeg error: {os.path.basename(output_file)}\n{stderr_tail}")
             return False
             
     except Exception as e:
-        print(f"    ❌ Error: {e}")
+        print(f"    ❌ Error ({os.path.basename(output_file)}): {e}")
         return False
 
-def upload_shorts_to_r2_and_db(video_id, shorts_dir, video_info, r2_config, database_url):
-    """Upload shorts to R2 and sync to database"""
+def short_video_id(video_id, i, segment):
+    """Video ID (filename without .mp4) of the i-th short cut from `segment`"""
+    return f"{video_id}_{sanitize_filename(segment['title'])}_{i}"
+
+def process_segment(video_id, video_file, shorts_dir, i, total, segment, threads=0):
+    """Cut one segment into a short, returning its video ID (safe to call from worker threads)"""
+    short_id = short_video_id(video_id, i, segment)
+    output_path = os.path.join(shorts_dir, f"{short_id}.mp4")
+    
+    print(f"  Segment {i}/{total}: {segment['title']} ({segment['start']:.0f}s - {segment['end']:.0f}s)")
+    
+    if cut_video_segment(video_file, output_path, segment['start'], segment['end'], threads):
+        return short_id
+    return None
+
+def cut_segments(video_id, video_file, shorts_dir, segments):
+    """Cut all segments in parallel, yielding each short's video ID as soon as it is ready"""
+    print(f"🎬 Processing {len(segments)} segment(s)...\n")
+    
+    # Each ffmpeg run is an independent subprocess, so threads are enough.
+    # Split the cores between parallel cuts so re-encodes don't oversubscribe.
+    cpu_count = os.cpu_count() or 1
+    workers = max(1, min(cpu_count, len(segments)))
+    ffmpeg_threads = max(1, cpu_count // workers)
+    
+    successful = 0
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = [
+            executor.submit(process_segment, video_id, video_file, shorts_dir, i, len(segments), segment, ffmpeg_threads)
+            for i, segment in enumerate(segments, 1)
+        ]
+        for future in as_completed(futures):
+            short_id = future.result()
+            if short_id:
+                successful += 1
+                yield short_id
+    
+    print(f"\n  ✅ Created {successful}/{len(segments)} shorts\n")
+
+def upload_shorts_to_r2_and_db(video_id, shorts, short_ids, shorts_dir, video_info, r2_config, database_url):
+    """Upload shorts to R2 as they become ready and sync to database
+    
+    `shorts` is an iterable of short video IDs (files `<id>.mp4` in
+    `shorts_dir`); each one is queued for upload as soon as it is produced, so uploads overlap with cutting.
+    `short_ids` lists every video ID the cuts can produce, known up front.
+    """
     print(f"\n☁️  Uploading shorts to R2 and database...")
     
-    # Initialize R2 client
-    s3_client = boto3.client(
-        's3',
-        endpoint_url=r2_config['endpoint'],
-        aws_access_key_id=r2_config['access_key'],
-        aws_secret_access_key=r2_config['secret_key'],
-        region_name='auto'
+    # Shorts are tens of MB: 16 MB parts keep them parallel, and the threshold
+    # matches the part size so nothing goes multipart as a single serial part
+    transfer_config = TransferConfig(
+        multipart_threshold=16 * 1024 * 1024,
+        multipart_chunksize=16 * 1024 * 1024,
+        max_concurrency=16,
+        use_threads=True
     )
     
+    s3_client = get_s3_client(r2_config['endpoint'], r2_config['access_key'], r2_config['secret_key'])
+    
     # Initialize database
     print(f"  🔌 Connecting to database...")
     try:
@@ -212,74 +299,116 @@ def upload_shorts_to_r2_and_db(video_id, shorts_dir, video_info, r2_config, data
         )
         Session = sessionmaker(bind=engine)
         session = Session()
-        session.execute("SELECT 1")
+        # Fail fast before any upload starts
+        engine.connect().close()
         print(f"  ✅ Connected to database")
     except Exception as e:
         print(f"  ❌ Database connection failed: {e}")
         return False
     
-    # Get all shorts
-    shorts = [f for f in os.listdir(shorts_dir) if f.endswith('.mp4')]
-    print(f"\n  📦 Found {len(shorts)} short(s) to upload\n")
+    # Check which shorts are already uploaded (one query for all of them)
+    existing = {
+        row.video_id: row
+        for row in session.query(Video.id, Video.video_id, Video.r2_url)
+        .filter(Video.video_id.in_(short_ids))
+        .all()
+    }
+    # Release the connection while cuts and uploads run; the final write
+    # checks out a fresh, pre-pinged one
+    session.commit()
     
-    uploaded = 0
-    for filename in shorts:
-        file_path = os.path.join(shorts_dir, filename)
-        short_video_id = filename.replace('.mp4', '')
-        
-        print(f"  Short: {filename}")
+    # List what is already in R2 once, so re-runs don't re-upload
+    existing_keys = {}
+    try:
+        paginator = s3_client.get_paginator('list_objects_v2')
+        for page in paginator.paginate(Bucket=r2_config['bucket'], Prefix=f"videos/{video_id}_"):
+            for obj in page.get('Contents', []):
+                existing_keys[obj['Key']] = obj['Size']
+    except (ClientError, BotoCoreError) as e:
+        # Fall back to uploading everything
+        existing_keys = {}
+        print(f"  ⚠️  Could not list existing R2 objects: {e}")
+    
+    # Queue every short on one transfer manager; rows are collected on this thread
+    new_rows = []
+    updates = []
+    uploads = []
+    with create_transfer_manager(s3_client, transfer_config) as transfer_manager:
+        for short_id in shorts:
+            filename = f"{short_id}.mp4"
+            row = existing.get(short_id)
+            if row and row.r2_url:
+                print(f"  Short: {filename}")
+                print(f"    ⚠️  Already uploaded, skipping")
+                continue
+            
+            # Skip the upload when R2 already holds an object of the same size
+            # under this key (e.g. left behind by a partial earlier run)
+            file_path = os.path.join(shorts_dir, filename)
+            object_key = f"videos/{filename}"
+            file_size = os.path.getsize(file_path)
+            future = None
+            if existing_keys.get(object_key) != file_size:
+                future = transfer_manager.upload(
+                    file_path,
+                    r2_config['bucket'],
+                    object_key,
+                    extra_args={'ContentType': 'video/mp4'}
+                )
+            uploads.append((short_id, filename, object_key, file_size, future))
         
-        # Check if already uploaded
-        existing = session.query(Video).filter_by(video_id=short_video_id).first()
-        if existing and existing.r2_url:
-            print(f"    ⚠️  Already uploaded, skipping")
-            continue
+        print(f"\n  📦 Queued {len(uploads)} short(s) for upload\n")
         
-        try:
-            # Upload to R2
-            object_key = f"videos/{filename}"
+        for short_id, filename, object_key, file_size, future in uploads:
+            print(f"  Short: {filename}")
             
-            with open(file_path, 'rb') as file_data:
-                s3_client.put_object(
-                    Bucket=r2_config['bucket'],
-                    Key=object_key,
-                    Body=file_data,
-                    ContentType='video/mp4'
-                )
+            size_mb = file_size / (1024 * 1024)
+            if future is None:
+                print(f"    ⚠️  Already in R2 ({size_mb:.2f} MB), skipping upload")
+            else:
+                try:
+                    future.result()
+                except Exception as e:
+                    print(f"    ❌ Failed: {e}")
+                    continue
+                print(f"    ✅ Uploaded to R2 ({size_mb:.2f} MB)")
             
             r2_url = f"{r2_config['public_url']}/{object_key}"
-            file_size = os.path.getsize(file_path) / (1024 * 1024)
-            
-            print(f"    ✅ Uploaded to R2 ({file_size:.2f} MB)")
-            
-            # Add/update database
-            if existing:
-                existing.r2_url = r2_url
-                existing.r2_key = object_key
-                existing.updated_at = datetime.utcnow()
+            row = existing.get(short_id)
+            if row:
+                updates.append({
+                    'id': row.id,
+                    'r2_url': r2_url,
+                    'r2_key': object_key,
+                    'updated_at': datetime.utcnow()
+                })
             else:
-                new_video = Video(
-                    video_id=short_video_id,
-                    filename=filename,
-                    title=video_info['title'],
-                    description=video_info['description'],
-                    duration=video_info['duration'],
-                    r2_url=r2_url,
-                    r2_key=object_key
-                )
-                session.add(new_video)
-            
+                new_rows.append({
+                    'video_id': short_id,
+                    'filename': filename,
+                    'title': video_info['title'],
+                    'description': video_info['description'],
+                    'duration': video_info['duration'],
+                    'r2_url': r2_url,
+                    'r2_key': object_key
+                })
+    
+    # Write all rows in a single transaction
+    uploaded = 0
+    if new_rows or updates:
+        try:
+            session.bulk_insert_mappings(Video, new_rows)
+            session.bulk_update_mappings(Video, updates)
             session.commit()
-            print(f"    ✅ Synced to database")
-            uploaded += 1
-            
+            uploaded = len(new_rows) + len(updates)
+            print(f"\n  ✅ Synced {uploaded} short(s) to database")
         except Exception as e:
-            print(f"    ❌ Failed: {e}")
+            print(f"\n  ❌ Database sync failed: {e}")
             session.rollback()
     
     session.close()
     
-    print(f"\n  ✅ Upload completed: {uploaded}/{len(shorts)} shorts")
+    print(f"\n  ✅ Upload completed: {uploaded}/{len(uploads)} shorts")
     return uploaded > 0
 
 def main():
@@ -297,6 +426,7 @@ def main():
     r2_bucket = os.environ.get('R2_SHORTS_BUCKET')
     r2_public_url = os.environ.get('R2_SHORTS_PUBLIC_URL')
     database_url = os.environ.get('DATABASE_URL')
+    ytdlp_concurrency = int(os.environ.get('YTDLP_CONCURRENCY', '8'))
     
     # Validate
     if not all([video_id, r2_access_key, r2_secret_key, r2_endpoint, r2_bucket, r2_public_url, database_url]):
@@ -305,11 +435,13 @@ def main():
     
     print(f"🎬 Video ID: {video_id}\n")
     
-    # Directories
-    downloads_dir = "downloads"
-    shorts_dir = "shorts"
+    # Directories (on tmpfs when available, so I/O stays in RAM)
+    work_dir = get_work_dir()
+    downloads_dir = os.path.join(work_dir, "downloads")
+    shorts_dir = os.path.join(work_dir, "shorts")
     os.makedirs(downloads_dir, exist_ok=True)
     os.makedirs(shorts_dir, exist_ok=True)
+    print(f"📁 Working directory: {work_dir}\n")
     
     # Find cookies
     cookies_file = None
@@ -319,7 +451,7 @@ def main():
             break
     
     # Step 1: Download from YouTube
-    video_file = download_youtube_video(video_id, downloads_dir, cookies_file)
+    video_file = download_youtube_video(video_id, downloads_dir, cookies_file, ytdlp_concurrency)
     if not video_file:
         print("❌ Download failed")
         sys.exit(1)
@@ -338,28 +470,7 @@ def main():
     segments = create_segments(video_id, video_file, video_info)
     print()
     
-    # Step 5: Process with FFmpeg
-    print(f"🎬 Processing {len(segments)} segment(s)...\n")
-    
-    successful = 0
-    for i, segment in enumerate(segments, 1):
-        safe_title = sanitize_filename(segment['title'])
-        output_filename = f"{video_id}_{safe_title}_{i}.mp4"
-        output_path = os.path.join(shorts_dir, output_filename)
-        
-        print(f"  Segment {i}/{len(segments)}: {segment['title']}")
-        print(f"    Time: {segment['start']:.0f}s - {segment['end']:.0f}s")
-        
-        if cut_video_segment(video_file, output_path, segment['start'], segment['end']):
-            successful += 1
-    
-    print(f"\n  ✅ Created {successful}/{len(segments)} shorts\n")
-    
-    if successful == 0:
-        print("❌ No shorts created")
-        sys.exit(1)
-    
-    # Step 6: Upload to R2 and database
+    # Step 5: Cut with FFmpeg and upload to R2 + database, overlapping both
     r2_config = {
         'access_key': r2_access_key,
         'secret_key': r2_secret_key,
@@ -368,7 +479,20 @@ def main():
         'public_url': r2_public_url
     }
     
-    success = upload_shorts_to_r2_and_db(video_id, shorts_dir, video_info, r2_config, database_url)
+    # Short names are deterministic, so existing rows can be looked up by ID
+    short_ids = [short_video_id(video_id, i, segment) for i, segment in enumerate(segments, 1)]
+    
+    shorts = cut_segments(video_id, video_file, shorts_dir, segments)
+    
+    # Wait for the first finished cut before touching R2 or the database;
+    # if the generator drains without one, every cut failed
+    first_short = next(shorts, None)
+    if first_short is None:
+        print("❌ No shorts created")
+        sys.exit(1)
+    shorts = chain([first_short], shorts)
+    
+    success = upload_shorts_to_r2_and_db(video_id, shorts, short_ids, shorts_dir, video_info, r2_config, database_url)
     
     if success:
         print("\n" + "="*60)
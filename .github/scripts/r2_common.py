@@ -0,0 +1,74 @@
+"""Helpers shared by the workflow scripts in .github/scripts"""
+
+import os
+import shutil
+import subprocess
+import threading
+from collections import deque
+from functools import lru_cache
+import boto3
+from botocore.config import Config as BotoConfig
+
+# Pooled connections per client; callers keep their transfer concurrency at
+# or below this so no part waits for a free socket
+MAX_POOL_CONNECTIONS = 32
+
+@lru_cache(maxsize=4)
+def get_s3_client(endpoint, access_key, secret_key):
+    """Return a shared S3 client for R2 (one per endpoint/credentials, thread-safe)"""
+    return boto3.client(
+        's3',
+        endpoint_url=endpoint,
+        aws_access_key_id=access_key,
+        aws_secret_access_key=secret_key,
+        region_name='auto',
+        config=BotoConfig(
+            max_pool_connections=MAX_POOL_CONNECTIONS,
+            retries={'max_attempts': 5, 'mode': 'adaptive'},
+            tcp_keepalive=True
+        )
+    )
+
+def run_streaming(cmd, timeout, echo=False, tail_bytes=2048):
+    """Run a command, draining stderr line by line while it runs
+    
+    Avoids buffering the whole output in memory (and stalling on a full
+    pipe). Returns (returncode, stderr_tail); only the last `tail_bytes`
+    of stderr are kept for error reporting.
+    """
+    # stdin is closed too: ffmpeg reads it for interactive keys, and parallel
+    # runs sharing the terminal would otherwise steal input from each other
+    proc = subprocess.Popen(
+        cmd,
+        stdin=subprocess.DEVNULL,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE,
+        text=True,
+        errors='replace'
+    )
+    tail = deque(maxlen=64)
+    
+    def drain():
+        for line in proc.stderr:
+            if echo:
+                print(f"    {line.rstrip()}")
+            tail.append(line)
+    
+    reader = threading.Thread(target=drain, daemon=True)
+    reader.start()
+    try:
+        proc.wait(timeout=timeout)
+    except subprocess.TimeoutExpired:
+        proc.kill()
+        proc.wait()
+        raise
+    finally:
+        reader.join(timeout=5)
+    
+    return proc.returncode, ''.join(tail)[-tail_bytes:]
+
+def get_work_dir(min_free=4 * 1024 ** 3):
+    """Return a RAM-backed (tmpfs) base directory when it has room, else '.'"""
+    if os.path.isdir('/dev/shm') and shutil.disk_usage('/dev/shm').free > min_free:
+        return '/dev/shm'
+    return '.'
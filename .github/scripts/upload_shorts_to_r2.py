@@ -123,8 +123,8 @@ def upload_shorts():
         Session = sessionmaker(bind=engine)
         session = Session()
         
-        # Test connection
-        session.execute("SELECT 1")
+        # Fail fast if the database is unreachable
+        engine.connect().close()
         print("✅ Connected to database successfully\n")
     except Exception as e:
         print(f"\n❌ Database connection failed!")
@@ -8,31 +8,10 @@ Uploads all shorts for a video_id to R2 bucket
 import os
 import sys
 import json
-import boto3
-from botocore.exceptions import ClientError
-from sqlalchemy import create_engine, Column, Integer, String, Text, DateTime, Float
-from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
+import queue
+import threading
 from datetime import datetime
 
-Base = declarative_base()
-
-class Video(Base):
-    """Video model matching the database schema"""
-    __tablename__ = 'videos'
-    
-    id = Column(Integer, primary_key=True)
-    video_id = Column(String(50), unique=True, nullable=False, index=True)
-    filename = Column(String(255), nullable=False)
-    title = Column(String(255))
-    description = Column(Text)
-    duration = Column(Float)
-    r2_url = Column(String(500))
-    r2_key = Column(String(500))
-    tiktok_description = Column(Text)
-    created_at = Column(DateTime, default=datetime.utcnow)
-    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
-
 # Get credentials from environment
 R2_ACCESS_KEY_ID = os.environ.get('R2_ACCESS_KEY')
 R2_SECRET_ACCESS_KEY = os.environ.get('R2_SECRET_KEY')
@@ -41,6 +20,10 @@ R2_BUCKET = os.environ.get('R2_BUCKET')
 R2_PUBLIC_URL = os.environ.get('R2_PUBLIC_URL')
 VIDEO_ID = os.environ.get('VIDEO_ID')
 DATABASE_URL = os.environ.get('DATABASE_URL')
+UPLOAD_CONCURRENCY = int(os.environ.get('UPLOAD_CONCURRENCY', '8'))
+R2_PART_SIZE_MB = int(os.environ.get('R2_PART_SIZE_MB', '64'))
+DB_FLUSH_EVERY = int(os.environ.get('DB_FLUSH_EVERY', '50'))
+VERIFY_UPLOADS = os.environ.get('VERIFY_UPLOADS') == '1'
 
 # Validate required variables
 if not all([VIDEO_ID, R2_ACCESS_KEY_ID, R2_SECRET_ACCESS_KEY, R2_ENDPOINT, R2_BUCKET, R2_PUBLIC_URL]):
@@ -66,6 +49,26 @@ if not DATABASE_URL.startswith('postgresql'):
     print(f"⚠️  Current DATABASE_URL: {DATABASE_URL[:50]}...")
     sys.exit(1)
 
+# Import boto3/SQLAlchemy only once the configuration is known to be valid,
+# so a misconfigured run exits before paying for them
+import boto3
+from boto3.s3.transfer import TransferConfig, BaseSubscriber, create_transfer_manager
+from botocore.config import Config as BotoConfig
+from botocore.exceptions import BotoCoreError, ClientError
+from sqlalchemy import create_engine, make_url, MetaData, Table, Column, String, DateTime
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+
+# Only the videos columns this script writes; id and the rest keep their database defaults
+videos = Table(
+    'videos', MetaData(),
+    Column('video_id', String(50), unique=True, nullable=False),
+    Column('filename', String(255), nullable=False),
+    Column('r2_url', String(500)),
+    Column('r2_key', String(500)),
+    Column('created_at', DateTime),
+    Column('updated_at', DateTime)
+)
+
 print("=" * 80)
 print(f"UPLOADING SHORTS TO R2")
 print("=" * 80)
@@ -76,38 +79,65 @@ print(f"🌐 Endpoint: {R2_ENDPOINT}")
 print(f"🎬 Video ID: {VIDEO_ID}")
 print()
 
-# Create S3 client
+# botocore >= 1.36 checksums every upload client-side by default; R2 does not
+# need it, so only compute checksums when an operation requires them
+checksum_options = {}
+if 'request_checksum_calculation' in BotoConfig.OPTION_DEFAULTS:
+    checksum_options = {
+        'request_checksum_calculation': 'when_required',
+        'response_checksum_validation': 'when_required'
+    }
+
+# Create S3 client: one client shared by every transfer thread, with enough
+# pooled keep-alive connections that parts never wait for a socket
 try:
     s3 = boto3.client(
         's3',
         endpoint_url=R2_ENDPOINT,
         aws_access_key_id=R2_ACCESS_KEY_ID,
         aws_secret_access_key=R2_SECRET_ACCESS_KEY,
-        region_name='auto'
+        region_name='auto',
+        config=BotoConfig(
+            max_pool_connections=max(32, 2 * UPLOAD_CONCURRENCY),
+            retries={'max_attempts': 5, 'mode': 'adaptive'},
+            tcp_keepalive=True,
+            s3={'addressing_style': 'path'},
+            **checksum_options
+        )
     )
     print("✓ S3 client created")
 except Exception as e:
     print(f"❌ Error creating S3 client: {e}")
     sys.exit(1)
 
+# Shorts go multipart in R2_PART_SIZE_MB parts once they exceed one part;
+# UPLOAD_CONCURRENCY is the total for all shorts
+transfer_config = TransferConfig(
+    multipart_threshold=R2_PART_SIZE_MB * 1024 * 1024,
+    multipart_chunksize=R2_PART_SIZE_MB * 1024 * 1024,
+    max_concurrency=UPLOAD_CONCURRENCY,
+    io_chunksize=1024 * 1024,
+    use_threads=True
+)
+
 # Connect to database
 print(f"🔌 Connecting to database...")
 print(f"   Database host: {DATABASE_URL.split('@')[1].split('/')[0] if '@' in DATABASE_URL else 'unknown'}")
 
 try:
+    # pg8000 names its connect timeout "timeout"; libpq-based drivers use "connect_timeout"
+    db_driver = make_url(DATABASE_URL).get_driver_name()
+    connect_args = {"timeout": 10} if db_driver == 'pg8000' else {"connect_timeout": 10}
+    
     engine = create_engine(
         DATABASE_URL,
         pool_pre_ping=True,
         pool_recycle=300,
-        connect_args={
-            "connect_timeout": 10,
-        }
+        connect_args=connect_args
     )
-    Session = sessionmaker(bind=engine)
-    session = Session()
     
-    # Test connection
-    session.execute("SELECT 1")
+    # Fail fast before scanning or uploading any short
+    engine.connect().close()
     print("✅ Connected to database successfully\n")
 except Exception as e:
     print(f"\n❌ Database connection failed!")
@@ -125,8 +155,13 @@ if not os.path.exists(shorts_dir):
     print(f"❌ Error: Shorts directory not found: {shorts_dir}")
     sys.exit(1)
 
-# Get all shorts for this video_id
-shorts_files = [f for f in os.listdir(shorts_dir) if f.startswith(VIDEO_ID) and f.endswith('.mp4')]
+# Get all shorts for this video_id as (name, path, size) from one directory scan
+# (cheap name checks first, so entries from other videos never reach is_file)
+with os.scandir(shorts_dir) as entries:
+    shorts_files = [
+        (e.name, e.path, e.stat().st_size) for e in entries
+        if e.name.startswith(VIDEO_ID) and e.name.endswith('.mp4') and e.is_file()
+    ]
 
 if not shorts_files:
     print(f"❌ Error: No shorts found for video {VIDEO_ID} in {shorts_dir}/")
@@ -135,91 +170,181 @@ if not shorts_files:
 print(f"📁 Found {len(shorts_files)} shorts to upload")
 print()
 
-# Upload each file
-success_count = 0
-failed_count = 0
+class UploadSubscriber(BaseSubscriber):
+    """Feeds a short's known size to the transfer, counts the bytes sent
+    and reports when it finishes"""
+    
+    def __init__(self, size, done_queue):
+        self.size = size
+        self.done_queue = done_queue
+        self.bytes_sent = 0
+        self.lock = threading.Lock()
+    
+    def on_queued(self, future, **kwargs):
+        # Size comes from the directory scan, so the transfer never stats the file
+        future.meta.provide_transfer_size(self.size)
+    
+    def on_progress(self, future, bytes_transferred, **kwargs):
+        # Parts of one file report from several transfer threads
+        with self.lock:
+            self.bytes_sent += bytes_transferred
+    
+    def on_done(self, future, **kwargs):
+        # Runs on a transfer thread: hand the future back to the main thread
+        self.done_queue.put(future)
 
-for filename in shorts_files:
-    filepath = os.path.join(shorts_dir, filename)
+# Credential/permission errors: every other upload would fail the same way
+FATAL_ERROR_CODES = {'InvalidAccessKeyId', 'SignatureDoesNotMatch', 'Unauthorized', 'AccessDenied'}
+
+def report_failure(error):
+    """Print why an upload failed, with a hint for credential errors
+    
+    Returns the S3 error code, or None for non-S3 errors.
+    """
+    if not isinstance(error, ClientError):
+        print(f"   ❌ Unexpected error: {error}")
+        return None
     
-    # R2 key structure: VIDEO_ID/filename
-    key = f"{VIDEO_ID}/{filename}"
+    error_code = error.response['Error']['Code']
+    error_msg = error.response['Error']['Message']
+    print(f"   ❌ Upload failed: {error_code} - {error_msg}")
     
-    file_size = os.path.getsize(filepath) / (1024 * 1024)  # MB
+    if error_code == 'InvalidAccessKeyId':
+        print(f"   💡 Invalid Access Key ID")
+        print(f"   → Check R2_ACCESS_KEY_ID secret in GitHub")
+    elif error_code == 'SignatureDoesNotMatch':
+        print(f"   💡 Invalid Secret Access Key")
+        print(f"   → Check R2_SECRET_ACCESS_KEY secret in GitHub")
+    elif error_code in ['Unauthorized', 'AccessDenied']:
+        print(f"   💡 No permission to upload")
+        print(f"   → Check R2 API token permissions (need Object Write)")
     
-    print(f"▶️  Uploading {filename} ({file_size:.2f} MB)...")
-    print(f"   📍 Key: {key}")
+    return error_code
+
+def flush_rows(batch):
+    """Write a batch of short rows with one INSERT ... ON CONFLICT
     
+    New shorts are inserted, re-uploaded ones refresh their URL and key.
+    Returns how many rows were written (0 if the transaction failed).
+    """
+    stmt = pg_insert(videos).values(batch)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=['video_id'],
+        set_={c: stmt.excluded[c] for c in ('filename', 'r2_url', 'r2_key', 'updated_at')}
+    )
     try:
-        # Upload to R2
-        s3.upload_file(
+        with engine.begin() as conn:
+            conn.execute(stmt)
+    except Exception as e:
+        print(f"❌ Database commit failed: {e}\n")
+        return 0
+    
+    print(f"✓ Database updated ({len(batch)} row(s))\n")
+    return len(batch)
+
+# Upload files concurrently; database writes stay on this thread and are
+# flushed every DB_FLUSH_EVERY rows while later uploads are still running
+success_count = 0
+failed_count = 0
+uploaded_keys = []
+rows = []
+done_queue = queue.Queue()
+
+# One transfer manager for every short: all parts share a single bounded
+# thread pool instead of a pool per file
+with create_transfer_manager(s3, transfer_config) as transfer_manager:
+    for filename, filepath, size in shorts_files:
+        # Pass the path, not an open handle: s3transfer defers open() until a
+        # transfer thread actually sends the file, so queued shorts hold no
+        # file descriptors and bodies stream from disk
+        # R2 key structure: VIDEO_ID/filename
+        transfer_manager.upload(
             filepath,
             R2_BUCKET,
-            key,
-            ExtraArgs={
+            f"{VIDEO_ID}/{filename}",
+            extra_args={
                 'ContentType': 'video/mp4',
                 'Metadata': {
                     'video_id': VIDEO_ID,
                     'original_filename': filename
                 }
-            }
+            },
+            subscribers=[UploadSubscriber(size, done_queue)]
         )
+    
+    for _ in range(len(shorts_files)):
+        future = done_queue.get()
+        subscriber = future.meta.call_args.subscribers[0]
+        key = future.meta.call_args.key
+        filename = key.split('/', 1)[1]
+        file_size = future.meta.size / (1024 * 1024)  # MB
         
-        # Verify upload
-        try:
-            s3.head_object(Bucket=R2_BUCKET, Key=key)
-            print(f"   ✅ Upload successful!")
-            
-            # Insert into database with filename
-            r2_url = f"{R2_PUBLIC_URL}/videos/{filename}"
-            short_name = filename.replace('.mp4', '')  # Remove extension for video_id
-            
-            # Check if already exists
-            existing = session.query(Video).filter_by(video_id=short_name).first()
-            if existing:
-                existing.r2_url = r2_url
-                existing.r2_key = key
-                existing.updated_at = datetime.utcnow()
-            else:
-                new_video = Video(
-                    video_id=short_name,
-                    filename=filename,
-                    r2_url=r2_url,
-                    r2_key=key
-                )
-                session.add(new_video)
-            
-            session.commit()
-            print(f"   ✓ Database updated")
-            
-            success_count += 1
-        except ClientError:
-            print(f"   ⚠️  Uploaded but verification failed")
-            success_count += 1
-            
-    except ClientError as e:
-        error_code = e.response['Error']['Code']
-        error_msg = e.response['Error']['Message']
-        print(f"   ❌ Upload failed: {error_code} - {error_msg}")
+        print(f"▶️  Uploading {filename} ({file_size:.2f} MB)...")
+        print(f"   📍 Key: {key}")
         
-        if error_code == 'InvalidAccessKeyId':
-            print(f"   💡 Invalid Access Key ID")
-            print(f"   → Check R2_ACCESS_KEY_ID secret in GitHub")
-        elif error_code == 'SignatureDoesNotMatch':
-            print(f"   💡 Invalid Secret Access Key")
-            print(f"   → Check R2_SECRET_ACCESS_KEY secret in GitHub")
-        elif error_code in ['Unauthorized', 'AccessDenied']:
-            print(f"   💡 No permission to upload")
-            print(f"   → Check R2 API token permissions (need Object Write)")
+        try:
+            # result() re-raises whatever the transfer failed with
+            future.result()
+        except Exception as e:
+            if report_failure(e) in FATAL_ERROR_CODES:
+                # Leaving the with block cancels the uploads still queued
+                print(f"\n❌ R2 rejected the credentials, aborting remaining uploads")
+                if rows:
+                    flush_rows(rows)
+                engine.dispose()
+                sys.exit(2)
+            failed_count += 1
+            print()
+            continue
+        print(f"   ✅ Upload successful! ({subscriber.bytes_sent / (1024 * 1024):.2f} MB sent)")
         
-        failed_count += 1
-        continue
+        # Queue the row for the next batched upsert
+        now = datetime.utcnow()
+        rows.append({
+            'video_id': filename[:-4],  # Remove extension for video_id
+            'filename': filename,
+            'r2_url': f"{R2_PUBLIC_URL}/videos/{filename}",
+            'r2_key': key,
+            'created_at': now,
+            'updated_at': now
+        })
+        print(f"   ✓ Queued database update")
+        uploaded_keys.append(key)
+        print()
         
-    except Exception as e:
-        print(f"   ❌ Unexpected error: {e}")
-        failed_count += 1
-        continue
+        if len(rows) >= DB_FLUSH_EVERY:
+            written = flush_rows(rows)
+            success_count += written
+            failed_count += len(rows) - written
+            rows = []
+
+# Write whatever is left after the last upload
+if rows:
+    written = flush_rows(rows)
+    success_count += written
+    failed_count += len(rows) - written
+
+# Optional verification: one listing covers every short instead of a HEAD each
+if VERIFY_UPLOADS and uploaded_keys:
+    print(f"🔍 Verifying uploads...")
+    stored_keys = set()
+    try:
+        paginator = s3.get_paginator('list_objects_v2')
+        for page in paginator.paginate(Bucket=R2_BUCKET, Prefix=f"{VIDEO_ID}/"):
+            for obj in page.get('Contents', []):
+                stored_keys.add(obj['Key'])
+    except (ClientError, BotoCoreError) as e:
+        # The uploads and rows are already committed; only the check is lost
+        print(f"   ⚠️  Could not verify uploads: {e}")
+        stored_keys = None
     
+    if stored_keys is not None:
+        missing = [key for key in uploaded_keys if key not in stored_keys]
+        if missing:
+            for key in missing:
+                print(f"   ⚠️  Uploaded but verification failed: {key}")
+        else:
+            print(f"   ✅ All {len(uploaded_keys)} uploads verified")
     print()
 
 # Summary
@@ -235,9 +360,8 @@ if success_count > 0:
 print("="  * 80)
 
 # Close database connection
-if 'session' in locals():
-    session.close()
-    print("✓ Database connection closed")
+engine.dispose()
+print("✓ Database connection closed")
 
 # Exit with error if no files uploaded
 if success_count == 0: